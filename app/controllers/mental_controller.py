@@ -1,20 +1,73 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
 from sqlalchemy.orm import Session
 
 from app.db.session import get_db
-from app.schemas.mental import PredictRequest, PredictResponse, HistoryResponse, LatestHistoryResponse
-from app.services.mental_service import predict_and_save, history_by_user, latest_history_by_user
+from app.schemas.mental import (
+    PredictRequest,
+    PredictResponse,
+    HistoryResponse,
+    LatestHistoryResponse,
+    ModelStatusResponse,
+)
+from app.services.mental_service import predict_and_save, history_by_user, latest_history_by_user, history_etag
+from app.services.idempotency_service import claim_idempotency_key, release_idempotency_key
+from app.services.model_registry import model_registry
 
 router = APIRouter(prefix="/mental", tags=["mental-health"])
 
+# History is per-user data: keep it out of shared caches and revalidate on every poll
+HISTORY_CACHE_CONTROL = "private, no-cache"
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # Weak comparison as required for If-None-Match (RFC 9110 13.1.2)
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    def opaque(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+
+    return any(opaque(tag) == opaque(etag) for tag in if_none_match.split(","))
+
+
+def _not_modified(etag: str) -> Response:
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={"ETag": etag, "Cache-Control": HISTORY_CACHE_CONTROL},
+    )
+
 
 @router.post("/predict", response_model=PredictResponse, status_code=status.HTTP_201_CREATED)
-def predict(payload: PredictRequest, db: Session = Depends(get_db)):
+def predict(
+    payload: PredictRequest,
+    response: Response,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
     try:
-        result = predict_and_save(db, payload)
+        claim = None
+        if idempotency_key is not None:
+            claim = claim_idempotency_key(db, idempotency_key, payload)
+            if claim.response is not None:
+                response.headers["Idempotent-Replayed"] = "true"
+                return PredictResponse(**claim.response)
+        try:
+            result = predict_and_save(db, payload, idempotency_claim=claim)
+        except Exception:
+            if claim is not None:
+                release_idempotency_key(db, claim)
+            raise
         return PredictResponse(**result)
     except ValueError as ve:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
+    except TimeoutError as te:
+        # Same key still in flight on another request
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(te))
     except RuntimeError as re:
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(re))
     except Exception as e:
@@ -22,21 +75,46 @@ def predict(payload: PredictRequest, db: Session = Depends(get_db)):
 
 
 @router.get("/history/{user_id}", response_model=HistoryResponse)
-def history(user_id: int, db: Session = Depends(get_db)):
+def history(
+    user_id: int,
+    response: Response,
+    db: Session = Depends(get_db),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+):
     try:
+        etag = history_etag(db, user_id)
+        if _etag_matches(if_none_match, etag):
+            return _not_modified(etag)
         data = history_by_user(db, user_id)
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = HISTORY_CACHE_CONTROL
         return HistoryResponse(message="Test history retrieved successfully.", data=data)
     except LookupError as le:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(le))
 
 
 @router.get("/history/{user_id}/latest", response_model=LatestHistoryResponse)
-def latest(user_id: int, db: Session = Depends(get_db)):
+def latest(
+    user_id: int,
+    response: Response,
+    db: Session = Depends(get_db),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+):
     try:
+        etag = history_etag(db, user_id)
+        if _etag_matches(if_none_match, etag):
+            return _not_modified(etag)
         data = latest_history_by_user(db, user_id)
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = HISTORY_CACHE_CONTROL
         if data is None:
             return LatestHistoryResponse(message="No test history found for this user.", data=None)
         return LatestHistoryResponse(message="Latest test history retrieved successfully.", data=data)
     except LookupError as le:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(le))
 
+
+@router.get("/model", response_model=ModelStatusResponse)
+def model_status():
+    # Served and shadow candidate versions plus the running shadow agreement
+    return ModelStatusResponse(message="Model status retrieved successfully.", data=model_registry.status())
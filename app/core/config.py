@@ -20,3 +20,19 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
 USE_GEMINI_SUGGESTION = os.getenv("USE_GEMINI_SUGGESTION", "false").lower() == "true"
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+
+# Idempotency keys for POST /mental/predict
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# Must exceed the slowest request (cold model load + Gemini); the lease is also renewed before the Gemini call
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "300"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+IDEMPOTENCY_PURGE_INTERVAL_SECONDS = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL_SECONDS", "60"))
+
+# Model registry
+# Versions are <version>.keras files in MODELS_DIR; MODEL_PATH is used when the directory has none
+MODELS_DIR = os.getenv("MODELS_DIR", "models")
+MODEL_PATH = os.getenv("MODEL_PATH", "psyche_model.keras")
+MODEL_WATCH_INTERVAL_SECONDS = float(os.getenv("MODEL_WATCH_INTERVAL_SECONDS", "30"))
+# Fraction of /mental/predict traffic also scored by the shadow candidate (0 disables)
+MODEL_SHADOW_SAMPLE_RATE = float(os.getenv("MODEL_SHADOW_SAMPLE_RATE", "0"))
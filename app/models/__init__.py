@@ -1,2 +1,4 @@
 from .user import User
 from .health_test import HealthTest
+from .idempotency_key import IdempotencyKey
+from .health_test_rescore import HealthTestRescore
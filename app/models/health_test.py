@@ -1,14 +1,19 @@
-from sqlalchemy import Column, Integer, String, DateTime, func, Text
+from sqlalchemy import Column, Integer, String, DateTime, func, Text, Index
 from app.db.session import Base
 from app.core.config import DATABASE_URL
 
 
 class HealthTest(Base):
     __tablename__ = "health_test"
-    __table_args__ = ({"schema": "public"} if not DATABASE_URL.startswith("sqlite") else {})
+    __table_args__ = (
+        # Covers the per-user max(id)/count(id)/max(updatedAt) aggregate behind the history ETag
+        Index("ix_health_test_userId_id_updatedAt", "userId", "id", "updatedAt"),
+        ({"schema": "public"} if not DATABASE_URL.startswith("sqlite") else {}),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    userId = Column(Integer, nullable=False, index=True)
+    # Per-user lookups use the leading column of ix_health_test_userId_id_updatedAt
+    userId = Column(Integer, nullable=False)
 
     appetite = Column(Integer, nullable=False)
     interest = Column(Integer, nullable=False)
@@ -24,8 +29,11 @@ class HealthTest(Base):
     restlessness = Column(Integer, nullable=False)
 
     depressionState = Column(Integer, nullable=False)
+    modelVersion = Column(String(64), nullable=True)
     generatedSuggestion = Column(Text, nullable=False)
     language = Column(String(8), nullable=False)
 
     healthTestDate = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # Bumped by any write that changes served values (e.g. in-place re-scoring) so history ETags change too
+    updatedAt = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
 
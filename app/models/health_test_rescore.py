@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, String, DateTime, func
+from app.db.session import Base
+from app.core.config import DATABASE_URL
+
+
+class HealthTestRescore(Base):
+    # Offline re-scoring results kept apart from the served health_test values
+    __tablename__ = "health_test_rescore"
+    __table_args__ = ({"schema": "public"} if not DATABASE_URL.startswith("sqlite") else {})
+
+    healthTestId = Column(Integer, primary_key=True)
+    depressionState = Column(Integer, nullable=False)
+    modelVersion = Column(String(64), nullable=True)
+    rescoredAt = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
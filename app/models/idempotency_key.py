@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, DateTime, func, Text
+from app.db.session import Base
+from app.core.config import DATABASE_URL
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_key"
+    __table_args__ = ({"schema": "public"} if not DATABASE_URL.startswith("sqlite") else {})
+
+    # Keys are scoped per user, so two clients picking the same key never collide
+    userId = Column(Integer, primary_key=True)
+    key = Column(String(255), primary_key=True)
+    requestHash = Column(String(64), nullable=False)
+    # Random per-claim token; only the request holding it may complete or release the key
+    claimToken = Column(String(32), nullable=False)
+
+    # 'in_progress' while the first request runs, 'completed' once the response is stored
+    status = Column(String(16), nullable=False)
+    responseBody = Column(Text, nullable=True)
+
+    createdAt = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    expiresAt = Column(DateTime(timezone=True), nullable=False, index=True)
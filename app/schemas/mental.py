@@ -41,3 +41,8 @@ class HistoryResponse(BaseModel):
 class LatestHistoryResponse(BaseModel):
     message: str
     data: Optional[dict]
+
+
+class ModelStatusResponse(BaseModel):
+    message: str
+    data: dict
@@ -0,0 +1,196 @@
+from typing import Dict, Any, Optional
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+
+from app.models.idempotency_key import IdempotencyKey
+from app.schemas.mental import PredictRequest
+from app.core.config import (
+    IDEMPOTENCY_TTL_SECONDS,
+    IDEMPOTENCY_LOCK_SECONDS,
+    IDEMPOTENCY_WAIT_SECONDS,
+    IDEMPOTENCY_MAX_KEYS,
+    IDEMPOTENCY_PURGE_INTERVAL_SECONDS,
+)
+
+STATUS_IN_PROGRESS = "in_progress"
+STATUS_COMPLETED = "completed"
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL_SECONDS = 0.1
+
+logger = logging.getLogger(__name__)
+
+# Per-process throttle for the expiry/capacity sweep
+_purge_lock = threading.Lock()
+_last_purge = 0.0
+
+
+@dataclass(frozen=True)
+class IdempotencyClaim:
+    userId: int
+    key: str
+    # Identifies this claim; completion, renewal and release only touch the row while it still holds this token
+    token: str
+    # Stored response when the key was already completed, None when the caller must run the request
+    response: Optional[Dict[str, Any]] = None
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _request_hash(payload: PredictRequest) -> str:
+    body = json.dumps(payload.model_dump(), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+def _purge_due() -> bool:
+    global _last_purge
+    with _purge_lock:
+        now = time.monotonic()
+        if now - _last_purge < IDEMPOTENCY_PURGE_INTERVAL_SECONDS:
+            return False
+        _last_purge = now
+        return True
+
+
+def _purge_expired(db: Session) -> None:
+    # Expired rows cover finished keys past their TTL as well as locks left behind by crashed workers
+    db.query(IdempotencyKey).filter(IdempotencyKey.expiresAt <= _now()).delete(synchronize_session=False)
+
+    # Keep the table bounded: drop the oldest completed keys once over capacity
+    overflow = db.query(IdempotencyKey.key).count() - IDEMPOTENCY_MAX_KEYS
+    if overflow > 0:
+        cutoff = (
+            db.query(IdempotencyKey.createdAt)
+            .filter(IdempotencyKey.status == STATUS_COMPLETED)
+            .order_by(IdempotencyKey.createdAt)
+            .offset(overflow - 1)
+            .limit(1)
+            .scalar()
+        )
+        if cutoff is not None:
+            db.query(IdempotencyKey).filter(
+                IdempotencyKey.status == STATUS_COMPLETED,
+                IdempotencyKey.createdAt <= cutoff,
+            ).delete(synchronize_session=False)
+    db.commit()
+
+
+def claim_idempotency_key(db: Session, key: str, payload: PredictRequest) -> IdempotencyClaim:
+    """Claim `key` for this request or return the response already stored for it.
+
+    A claim without `response` means the caller owns the key and must run the request,
+    finishing with `predict_and_save(..., idempotency_claim=claim)` or `release_idempotency_key`.
+    If another request holds the key, waits for its result instead of racing it.
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"Idempotency-Key must be between 1 and {MAX_KEY_LENGTH} characters.")
+
+    request_hash = _request_hash(payload)
+
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        row = (
+            db.query(IdempotencyKey)
+            .filter(
+                IdempotencyKey.userId == payload.userId,
+                IdempotencyKey.key == key,
+                IdempotencyKey.expiresAt > _now(),
+            )
+            .first()
+        )
+        if row is None:
+            # Only sweep when a new row is about to be written, and at most once per interval
+            if _purge_due():
+                _purge_expired(db)
+            # Drop an expired row for this key, then try to take it; a live claim committed since the read
+            # above is left alone so the insert below conflicts and this request waits on it
+            db.query(IdempotencyKey).filter(
+                IdempotencyKey.userId == payload.userId,
+                IdempotencyKey.key == key,
+                IdempotencyKey.expiresAt <= _now(),
+            ).delete(synchronize_session=False)
+            token = uuid.uuid4().hex
+            db.add(IdempotencyKey(
+                key=key,
+                userId=payload.userId,
+                requestHash=request_hash,
+                claimToken=token,
+                status=STATUS_IN_PROGRESS,
+                expiresAt=_now() + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+            ))
+            try:
+                db.commit()
+                return IdempotencyClaim(userId=payload.userId, key=key, token=token)
+            except IntegrityError:
+                # Another request claimed it first; wait on its result
+                db.rollback()
+                continue
+
+        if row.requestHash != request_hash:
+            raise ValueError("Idempotency-Key was already used with a different request payload.")
+        if row.status == STATUS_COMPLETED:
+            logger.info("Replaying stored response for Idempotency-Key %s", key)
+            return IdempotencyClaim(
+                userId=payload.userId, key=key, token=row.claimToken, response=json.loads(row.responseBody)
+            )
+        if time.monotonic() >= deadline:
+            raise TimeoutError("A request with this Idempotency-Key is still being processed. Retry later.")
+
+        # End the read transaction so the next poll sees the other request's commit
+        db.rollback()
+        db.expunge_all()
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+
+def _owned(db: Session, claim: IdempotencyClaim):
+    return db.query(IdempotencyKey).filter(
+        IdempotencyKey.userId == claim.userId,
+        IdempotencyKey.key == claim.key,
+        IdempotencyKey.claimToken == claim.token,
+        IdempotencyKey.status == STATUS_IN_PROGRESS,
+    )
+
+
+def renew_idempotency_lease(db: Session, claim: IdempotencyClaim) -> None:
+    """Extend the in-flight lock before slow work; fails if the lease already lapsed and the key was re-claimed."""
+    renewed = _owned(db, claim).update(
+        {IdempotencyKey.expiresAt: _now() + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)},
+        synchronize_session=False,
+    )
+    db.commit()
+    if not renewed:
+        raise TimeoutError("Idempotency-Key lease expired and the key was taken over by a retry.")
+
+
+def store_idempotent_response(db: Session, claim: IdempotencyClaim, response: Dict[str, Any]) -> None:
+    """Attach the final response to the claimed key; committed by the caller with the result it belongs to.
+
+    Raises if the claim was lost, so the caller rolls back instead of inserting a duplicate record.
+    """
+    stored = _owned(db, claim).update(
+        {
+            IdempotencyKey.status: STATUS_COMPLETED,
+            IdempotencyKey.responseBody: json.dumps(response),
+            IdempotencyKey.expiresAt: _now() + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+        },
+        synchronize_session=False,
+    )
+    if not stored:
+        raise TimeoutError("Idempotency-Key lease expired and the key was taken over by a retry.")
+
+
+def release_idempotency_key(db: Session, claim: IdempotencyClaim) -> None:
+    """Free a claimed key after a failed request so a retry can run it again."""
+    db.rollback()
+    _owned(db, claim).delete(synchronize_session=False)
+    db.commit()
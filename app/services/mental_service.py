@@ -1,67 +1,27 @@
-from typing import Dict, Any, List, Optional
-from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
 import logging
 
 import numpy as np
 
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy import desc, func
 
 from app.models.user import User
 from app.models.health_test import HealthTest
 from app.schemas.mental import PredictRequest, MENTAL_HEALTH_FIELDS
 from app.core.config import USE_GEMINI_SUGGESTION, GEMINI_API_KEY, GEMINI_MODEL
+from app.services.idempotency_service import IdempotencyClaim, renew_idempotency_lease, store_idempotent_response
+from app.services.model_registry import model_registry
 
-# Lazy-loaded ML model
-action_model = None
-model_load_error: Optional[Exception] = None
 logger = logging.getLogger(__name__)
 
 
-def _load_model_once():
-    global action_model, model_load_error
-    if action_model is not None or model_load_error is not None:
-        return
-    try:
-        # Try TensorFlow first
-        try:
-            from tensorflow.keras.models import load_model  # type: ignore
-        except Exception:
-            load_model = None  # type: ignore
-        model_path = Path("psyche_model.keras")
-        if not model_path.exists():
-            raise FileNotFoundError(f"Model file not found: {model_path}")
-        if load_model is not None:
-            action_model = load_model(model_path)
-            return
-        # Fallback to keras v3 loader
-        try:
-            from keras.models import load_model as load_model_k3  # type: ignore
-            action_model = load_model_k3(model_path)
-            return
-        except Exception as e2:
-            raise e2
-    except Exception as e:
-        model_load_error = e
-
-
-def _predict_depression_state(scores: List[float]) -> int:
-    _load_model_once()
-    if model_load_error is not None:
-        raise RuntimeError(f"Model not available: {model_load_error}")
-    if action_model is None:
-        raise RuntimeError("Model failed to load")
-
-    x = np.array([scores], dtype=float)
-    y = action_model.predict(x, verbose=0)
-
-    arr = np.array(y)
-    if arr.ndim >= 2 and arr.shape[-1] in (4,):
-        idx = int(np.argmax(arr.reshape(-1, arr.shape[-1])[0]))
-        return max(0, min(3, idx))
-    val = float(arr.reshape(-1)[0])
-    cls = int(round(val))
-    return max(0, min(3, cls))
+def _predict_depression_state(scores: List[float]) -> Tuple[int, str]:
+    # Hold one reference for the whole call so a concurrent model swap cannot affect it
+    loaded = model_registry.get()
+    state = int(loaded.predict_states(np.array([scores], dtype=float))[0])
+    model_registry.shadow(scores, state, loaded.version)
+    return state, loaded.version
 
 
 def _build_specific_score_details(scores: List[int], language: str) -> str:
@@ -167,17 +127,22 @@ def _suggestion_for_state(state: int, language: str) -> str:
     return mapping.get(state, mapping[0])
 
 
-def predict_and_save(db: Session, payload: PredictRequest) -> Dict[str, Any]:
+def predict_and_save(
+    db: Session, payload: PredictRequest, idempotency_claim: Optional[IdempotencyClaim] = None
+) -> Dict[str, Any]:
     user = db.query(User).filter(User.id == payload.userId).first()
     if not user:
         raise ValueError("Invalid userId. User does not exist.")
 
     scores = [int(getattr(payload, f)) for f in MENTAL_HEALTH_FIELDS]
 
-    depression_state = _predict_depression_state(scores)
+    depression_state, model_version = _predict_depression_state(scores)
 
     suggestion: str
     if USE_GEMINI_SUGGESTION and GEMINI_API_KEY:
+        if idempotency_claim is not None:
+            # Inference may have been slow (cold model load); keep the key locked through the Gemini call
+            renew_idempotency_lease(db, idempotency_claim)
         try:
             logger.info("Using Gemini for suggestion (model=%s)", GEMINI_MODEL)
             suggestion = _suggestion_with_gemini(depression_state, payload.language, scores)
@@ -193,14 +158,15 @@ def predict_and_save(db: Session, payload: PredictRequest) -> Dict[str, Any]:
         userId=payload.userId,
         language=payload.language,
         depressionState=depression_state,
+        modelVersion=model_version,
         generatedSuggestion=suggestion,
         **{f: int(getattr(payload, f)) for f in MENTAL_HEALTH_FIELDS},
     )
     db.add(rec)
-    db.commit()
+    db.flush()
     db.refresh(rec)
 
-    return {
+    result = {
         "message": "Depression state predicted and recorded successfully.",
         "depressionState": depression_state,
         "suggestion": suggestion,
@@ -209,12 +175,39 @@ def predict_and_save(db: Session, payload: PredictRequest) -> Dict[str, Any]:
             "userId": rec.userId,
             **{f: getattr(rec, f) for f in MENTAL_HEALTH_FIELDS},
             "depressionState": rec.depressionState,
+            "modelVersion": rec.modelVersion,
             "generatedSuggestion": rec.generatedSuggestion,
             "language": rec.language,
             "healthTestDate": rec.healthTestDate.isoformat() if rec.healthTestDate else None,
         },
     }
 
+    # Store the response in the same transaction as the record so a retry can never insert it twice
+    if idempotency_claim is not None:
+        store_idempotent_response(db, idempotency_claim, result)
+    db.commit()
+
+    return result
+
+
+def history_etag(db: Session, user_id: int) -> str:
+    """Validator for a user's history, changing whenever a test is added, removed or updated.
+
+    Uses a single aggregate over the (userId, id, updatedAt) index, so no rows are loaded.
+    """
+    row = (
+        db.query(User.id, func.max(HealthTest.id), func.count(HealthTest.id), func.max(HealthTest.updatedAt))
+        .outerjoin(HealthTest, HealthTest.userId == User.id)
+        .filter(User.id == user_id)
+        .group_by(User.id)
+        .first()
+    )
+    if not row:
+        raise LookupError("User not found.")
+    _, max_id, count, updated = row
+    updated_tag = updated.strftime("%Y%m%d%H%M%S%f") if updated else "0"
+    return f'W/"{user_id}-{count}-{max_id or 0}-{updated_tag}"'
+
 
 def history_by_user(db: Session, user_id: int) -> List[Dict[str, Any]]:
     if not db.query(User.id).filter(User.id == user_id).first():
@@ -232,6 +225,7 @@ def history_by_user(db: Session, user_id: int) -> List[Dict[str, Any]]:
             "userId": r.userId,
             **{f: getattr(r, f) for f in MENTAL_HEALTH_FIELDS},
             "depressionState": r.depressionState,
+            "modelVersion": r.modelVersion,
             "generatedSuggestion": r.generatedSuggestion,
             "language": r.language,
             "healthTestDate": r.healthTestDate.isoformat() if r.healthTestDate else None,
@@ -257,6 +251,7 @@ def latest_history_by_user(db: Session, user_id: int) -> Optional[Dict[str, Any]
         "userId": r.userId,
         **{f: getattr(r, f) for f in MENTAL_HEALTH_FIELDS},
         "depressionState": r.depressionState,
+        "modelVersion": r.modelVersion,
         "generatedSuggestion": r.generatedSuggestion,
         "language": r.language,
         "healthTestDate": r.healthTestDate.isoformat() if r.healthTestDate else None,
@@ -0,0 +1,270 @@
+from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+import logging
+import random
+import threading
+
+import numpy as np
+
+from app.schemas.mental import MENTAL_HEALTH_FIELDS
+from app.core.config import MODELS_DIR, MODEL_PATH, MODEL_WATCH_INTERVAL_SECONDS, MODEL_SHADOW_SAMPLE_RATE
+
+# Optional file in the models directory naming the version to serve (e.g. "v3")
+ACTIVE_FILE = "ACTIVE"
+MAX_PENDING_SHADOW = 8
+
+logger = logging.getLogger(__name__)
+
+
+def load_keras_model(path: Path) -> Any:
+    if not path.exists():
+        raise FileNotFoundError(f"Model file not found: {path}")
+    # Try TensorFlow first
+    try:
+        from tensorflow.keras.models import load_model  # type: ignore
+    except Exception:
+        load_model = None  # type: ignore
+    if load_model is not None:
+        return load_model(path)
+    # Fallback to keras v3 loader
+    from keras.models import load_model as load_model_k3  # type: ignore
+    return load_model_k3(path)
+
+
+def decode_depression_states(y: Any, n: int) -> np.ndarray:
+    """Map raw model output for a batch of `n` rows to classes 0..3."""
+    arr = np.asarray(y)
+    if arr.ndim >= 2 and arr.shape[-1] in (4,):
+        return np.clip(np.argmax(arr.reshape(n, -1, 4)[:, 0, :], axis=-1), 0, 3).astype(int)
+    vals = arr.reshape(n, -1)[:, 0].astype(float)
+    return np.clip(np.rint(vals), 0, 3).astype(int)
+
+
+@dataclass(frozen=True)
+class LoadedModel:
+    version: str
+    path: Path
+    # File mtime at load time, so a version overwritten under the same name is picked up again
+    mtime: float
+    model: Any
+
+    def is_current(self, path: Path) -> bool:
+        return self.path == path and self.mtime == path.stat().st_mtime
+
+    def predict_states(self, x: np.ndarray) -> np.ndarray:
+        y = self.model.predict(x, batch_size=max(1, len(x)), verbose=0)
+        return decode_depression_states(y, len(x))
+
+
+class ModelRegistry:
+    """Serves the current model version and hot-swaps in new ones from a directory.
+
+    Requests read `get()` once and keep that reference, so a swap never
+    interrupts a prediction already running on the previous version.
+    """
+
+    def __init__(self, models_dir: Path, fallback_path: Path, watch_interval: float, shadow_sample_rate: float):
+        self.models_dir = models_dir
+        self.fallback_path = fallback_path
+        self.watch_interval = watch_interval
+        self.shadow_sample_rate = shadow_sample_rate
+
+        self._active: Optional[LoadedModel] = None
+        self._candidate: Optional[LoadedModel] = None
+        self._load_error: Optional[Exception] = None
+        # path -> mtime of files that failed to load, so a broken file is not retried every scan
+        self._failed: Dict[str, float] = {}
+        self._refresh_lock = threading.Lock()
+
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+        self._shadow_executor: Optional[ThreadPoolExecutor] = None
+        self._shadow_slots = threading.BoundedSemaphore(MAX_PENDING_SHADOW)
+        self._stats_lock = threading.Lock()
+        self._shadow_compared = 0
+        self._shadow_agreed = 0
+
+    def get(self) -> LoadedModel:
+        active = self._active
+        if active is None:
+            self.refresh()
+            active = self._active
+        if active is None:
+            raise RuntimeError(f"Model not available: {self._load_error or 'no model file found'}")
+        return active
+
+    def _version_path(self, version: Optional[str]) -> Path:
+        if version is None:
+            path, _ = self._discover()
+            if path is None:
+                raise RuntimeError(f"Model not available: no model found in {self.models_dir} or at {self.fallback_path}")
+            return path
+        path = self.models_dir / f"{version}.keras"
+        if not path.exists() and self.fallback_path.stem == version:
+            path = self.fallback_path
+        if not path.exists():
+            raise RuntimeError(f"Model not available: no version '{version}' in {self.models_dir}")
+        return path
+
+    def resolve_version(self, version: Optional[str] = None) -> str:
+        """Concrete version name for `version`, or for the one that would be served right now."""
+        return self._version_path(version).stem
+
+    def load_version(self, version: Optional[str] = None) -> LoadedModel:
+        """Load a version outside the serving slot (e.g. for offline jobs); defaults to the one that would be served."""
+        path = self._version_path(version)
+        try:
+            mtime = path.stat().st_mtime
+            return LoadedModel(version=path.stem, path=path, mtime=mtime, model=load_keras_model(path))
+        except Exception as e:
+            raise RuntimeError(f"Model not available: {e}") from e
+
+    def status(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            compared, agreed = self._shadow_compared, self._shadow_agreed
+        return {
+            "active": self._active.version if self._active else None,
+            "candidate": self._candidate.version if self._candidate else None,
+            "shadowCompared": compared,
+            "shadowAgreement": (agreed / compared) if compared else None,
+        }
+
+    def _discover(self) -> Tuple[Optional[Path], Optional[Path]]:
+        """Return (path to serve, shadow candidate path)."""
+        versions: List[Path] = []
+        if self.models_dir.is_dir():
+            versions = sorted(self.models_dir.glob("*.keras"), key=lambda p: (p.stat().st_mtime, p.name))
+        if not versions:
+            return (self.fallback_path if self.fallback_path.exists() else None), None
+
+        latest = versions[-1]
+        active_file = self.models_dir / ACTIVE_FILE
+        if not active_file.exists():
+            return latest, None
+
+        pinned = self.models_dir / f"{active_file.read_text().strip()}.keras"
+        if not pinned.exists():
+            logger.warning("%s names missing model %s; serving latest %s", active_file, pinned.name, latest.name)
+            return latest, None
+        # Anything newer than the pinned version is shadowed until ACTIVE is updated
+        candidate = latest if latest != pinned and self.shadow_sample_rate > 0 else None
+        return pinned, candidate
+
+    def _load(self, path: Path) -> Optional[LoadedModel]:
+        mtime = path.stat().st_mtime
+        if self._failed.get(str(path)) == mtime:
+            return None
+        try:
+            model = load_keras_model(path)
+            # Warm up so the first real request does not pay for graph tracing
+            model.predict(np.ones((1, len(MENTAL_HEALTH_FIELDS)), dtype=float), verbose=0)
+        except Exception as e:
+            logger.exception("Failed to load model %s", path)
+            self._failed[str(path)] = mtime
+            self._load_error = e
+            return None
+        self._failed.pop(str(path), None)
+        return LoadedModel(version=path.stem, path=path, mtime=mtime, model=model)
+
+    def refresh(self) -> None:
+        """Load any new serving/candidate version and swap it in once warmed up."""
+        with self._refresh_lock:
+            serving_path, candidate_path = self._discover()
+            if serving_path is None:
+                if self._active is None:
+                    self._load_error = FileNotFoundError(f"No model found in {self.models_dir} or at {self.fallback_path}")
+                return
+
+            if self._active is None or not self._active.is_current(serving_path):
+                if self._candidate is not None and self._candidate.is_current(serving_path):
+                    loaded: Optional[LoadedModel] = self._candidate
+                else:
+                    loaded = self._load(serving_path)
+                if loaded is not None:
+                    previous = self._active
+                    # Single reference assignment: in-flight requests keep the model they already hold
+                    self._active = loaded
+                    self._load_error = None
+                    logger.info("Serving model version %s (was %s)", loaded.version, previous.version if previous else None)
+
+            if candidate_path is None:
+                self._candidate = None
+            elif self._candidate is None or not self._candidate.is_current(candidate_path):
+                candidate = self._load(candidate_path)
+                if candidate is not None:
+                    self._candidate = candidate
+                    with self._stats_lock:
+                        self._shadow_compared = 0
+                        self._shadow_agreed = 0
+                    logger.info("Shadowing candidate model version %s", candidate.version)
+
+    def shadow(self, scores: List[float], served_state: int, served_version: str) -> None:
+        """Score a sample of requests with the candidate in the background and record agreement."""
+        candidate = self._candidate
+        executor = self._shadow_executor
+        if candidate is None or executor is None or random.random() >= self.shadow_sample_rate:
+            return
+        # Drop the sample rather than queueing work behind a slow candidate
+        if not self._shadow_slots.acquire(blocking=False):
+            return
+        try:
+            executor.submit(self._compare, candidate, scores, served_state, served_version)
+        except RuntimeError:
+            # Executor shut down by stop() between the read above and the submit
+            self._shadow_slots.release()
+
+    def _compare(self, candidate: LoadedModel, scores: List[float], served_state: int, served_version: str) -> None:
+        try:
+            state = int(candidate.predict_states(np.array([scores], dtype=float))[0])
+            with self._stats_lock:
+                self._shadow_compared += 1
+                self._shadow_agreed += int(state == served_state)
+                compared, agreed = self._shadow_compared, self._shadow_agreed
+            if state != served_state:
+                logger.info(
+                    "Shadow disagreement: %s=%d, candidate %s=%d (agreement %d/%d)",
+                    served_version, served_state, candidate.version, state, agreed, compared,
+                )
+        except Exception:
+            logger.warning("Shadow scoring with model %s failed", candidate.version, exc_info=True)
+        finally:
+            self._shadow_slots.release()
+
+    def start(self) -> None:
+        """Start the shadow executor and the background watcher; the first scan loads and warms the model."""
+        if self.shadow_sample_rate > 0 and self._shadow_executor is None:
+            self._shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-shadow")
+        if self.watch_interval <= 0 or self._watcher is not None:
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, name="model-registry", daemon=True)
+        self._watcher.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=5)
+            self._watcher = None
+        if self._shadow_executor is not None:
+            self._shadow_executor.shutdown(wait=False)
+            self._shadow_executor = None
+
+    def _watch(self) -> None:
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Model registry scan failed")
+            if self._stop.wait(self.watch_interval):
+                return
+
+
+model_registry = ModelRegistry(
+    models_dir=Path(MODELS_DIR),
+    fallback_path=Path(MODEL_PATH),
+    watch_interval=MODEL_WATCH_INTERVAL_SECONDS,
+    shadow_sample_rate=MODEL_SHADOW_SAMPLE_RATE,
+)
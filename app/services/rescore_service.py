@@ -0,0 +1,269 @@
+from typing import Dict, Any, List, Optional, Tuple
+from dataclasses import dataclass, asdict
+from pathlib import Path
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from sqlalchemy.orm import Session
+from sqlalchemy import MetaData, Table, Integer, select, update, delete, insert, bindparam, func, text
+
+from app.db.session import SessionLocal, engine
+from app.models.health_test import HealthTest
+from app.models.health_test_rescore import HealthTestRescore
+from app.schemas.mental import MENTAL_HEALTH_FIELDS
+from app.services.model_registry import model_registry, LoadedModel
+
+TARGET_INPLACE = "inplace"
+TARGET_COLUMN = "column"
+TARGET_TABLE = "table"
+TARGETS = (TARGET_INPLACE, TARGET_COLUMN, TARGET_TABLE)
+PLAN_FILE = "plan.json"
+# Columns --target column must never write into: model inputs, keys, and values the API serves
+PROTECTED_COLUMNS = set(MENTAL_HEALTH_FIELDS) | {
+    "id", "userId", "depressionState", "modelVersion", "generatedSuggestion", "language", "healthTestDate",
+}
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ShardTask:
+    shard: int
+    startId: int
+    endId: int
+    target: str
+    column: Optional[str]
+    chunkSize: int
+    modelVersion: str
+    checkpointDir: Optional[str]
+    resume: bool
+
+
+@dataclass
+class ShardResult:
+    shard: int
+    startId: int
+    endId: int
+    lastId: Optional[int]
+    rows: int
+    changed: int
+    seconds: float
+    modelVersion: Optional[str] = None
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+
+def id_bounds(db: Session) -> Tuple[Optional[int], Optional[int]]:
+    lo, hi = db.execute(select(func.min(HealthTest.id), func.max(HealthTest.id))).one()
+    return lo, hi
+
+
+def split_id_range(lo: int, hi: int, shards: int) -> List[Tuple[int, int]]:
+    """Split the inclusive id range [lo, hi] into at most `shards` contiguous ranges."""
+    shards = max(1, min(shards, hi - lo + 1))
+    step = (hi - lo + 1) // shards
+    ranges = []
+    start = lo
+    for i in range(shards):
+        end = hi if i == shards - 1 else start + step - 1
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+
+def _reflect_health_test() -> Table:
+    # The ORM model only knows declared columns; --target column writes into ones added by hand
+    table = HealthTest.__table__
+    return Table(table.name, MetaData(), schema=table.schema, autoload_with=engine)
+
+
+def validate_target(target: str, column: Optional[str]) -> None:
+    if target not in TARGETS:
+        raise ValueError(f"Unknown target '{target}'. Use one of: {', '.join(TARGETS)}")
+    if target != TARGET_COLUMN:
+        return
+    if not column:
+        raise ValueError("--column is required with target 'column'")
+    reflected = _reflect_health_test()
+    if column not in reflected.c:
+        raise ValueError(f"Column '{column}' does not exist on {reflected.name}; add it before re-scoring into it")
+    if column in PROTECTED_COLUMNS:
+        raise ValueError(f"Refusing to overwrite column '{column}'; use --target inplace to replace served values")
+    if not isinstance(reflected.c[column].type, Integer):
+        raise ValueError(f"Column '{column}' must be an integer column, not {reflected.c[column].type}")
+
+
+def _checkpoint_path(checkpoint_dir: Optional[str], task: ShardTask) -> Optional[Path]:
+    if not checkpoint_dir:
+        return None
+    return Path(checkpoint_dir) / f"shard-{task.shard}-{task.startId}-{task.endId}.json"
+
+
+def _write_json(path: Path, data: Dict[str, Any]) -> None:
+    # Write-then-rename so a crash never leaves a truncated checkpoint
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(data, indent=2))
+    os.replace(tmp, path)
+
+
+def _write_results(
+    db: Session, task: ShardTask, table: Table, ids: List[int], states: np.ndarray, version: str
+) -> None:
+    if task.target == TARGET_TABLE:
+        rescore = HealthTestRescore.__table__
+        db.execute(delete(rescore).where(rescore.c.healthTestId.in_(ids)))
+        db.execute(
+            insert(rescore),
+            [{"healthTestId": i, "depressionState": int(s), "modelVersion": version} for i, s in zip(ids, states)],
+        )
+        return
+
+    if task.target == TARGET_COLUMN:
+        values = {table.c[task.column]: bindparam("b_state")}
+        params = [{"b_id": i, "b_state": int(s)} for i, s in zip(ids, states)]
+    else:
+        # updatedAt moves the history ETag so polling clients see the new values
+        values = {
+            "depressionState": bindparam("b_state"),
+            "modelVersion": bindparam("b_version"),
+            "updatedAt": func.now(),
+        }
+        params = [{"b_id": i, "b_state": int(s), "b_version": version} for i, s in zip(ids, states)]
+    # One executemany UPDATE per chunk
+    db.execute(update(table).where(table.c.id == bindparam("b_id")).values(values), params)
+
+
+def rescore_shard(task: ShardTask) -> ShardResult:
+    """Re-score ids in [startId, endId] chunk by chunk, committing and checkpointing after each chunk."""
+    loaded: LoadedModel = model_registry.load_version(task.modelVersion)
+    checkpoint = _checkpoint_path(task.checkpointDir, task)
+
+    result = ShardResult(task.shard, task.startId, task.endId, None, 0, 0, 0.0, loaded.version)
+    if task.resume and checkpoint is not None and checkpoint.exists():
+        saved = json.loads(checkpoint.read_text())
+        if saved.get("modelVersion") != loaded.version:
+            raise ValueError(
+                f"Checkpoint {checkpoint} was written by model {saved.get('modelVersion')}, not {loaded.version}"
+            )
+        result = ShardResult(**saved)
+    from_id = task.startId if result.lastId is None else result.lastId + 1
+    if from_id > task.endId:
+        logger.info("Shard %d already complete", task.shard)
+        return result
+
+    cols = [getattr(HealthTest, f) for f in MENTAL_HEALTH_FIELDS]
+    stmt = (
+        select(HealthTest.id, HealthTest.depressionState, *cols)
+        .where(HealthTest.id >= from_id, HealthTest.id <= task.endId)
+        .order_by(HealthTest.id)
+        .execution_options(yield_per=task.chunkSize)
+    )
+
+    table = _reflect_health_test() if task.target == TARGET_COLUMN else HealthTest.__table__
+
+    read_db = SessionLocal()
+    write_db = SessionLocal()
+    try:
+        if engine.dialect.name == "sqlite":
+            # Let the writer commit while the streaming read is still open
+            write_db.execute(text("PRAGMA journal_mode=WAL"))
+        started = time.perf_counter() - result.seconds
+        for chunk in read_db.execute(stmt).partitions():
+            ids = [row[0] for row in chunk]
+            previous = np.fromiter((row[1] for row in chunk), dtype=int, count=len(chunk))
+            x = np.array([row[2:] for row in chunk], dtype=float)
+
+            states = loaded.predict_states(x)
+            _write_results(write_db, task, table, ids, states, loaded.version)
+            write_db.commit()
+
+            result.lastId = ids[-1]
+            result.rows += len(ids)
+            result.changed += int(np.count_nonzero(states != previous))
+            result.seconds = time.perf_counter() - started
+            if checkpoint is not None:
+                _write_json(checkpoint, asdict(result))
+            logger.info(
+                "Shard %d: %d rows through id %d (%.0f rows/s)",
+                task.shard, result.rows, result.lastId, result.rows_per_second,
+            )
+    finally:
+        read_db.close()
+        write_db.close()
+    return result
+
+
+def load_plan(checkpoint_dir: Optional[str]) -> Optional[Dict[str, Any]]:
+    plan_path = Path(checkpoint_dir) / PLAN_FILE if checkpoint_dir else None
+    if plan_path is None or not plan_path.exists():
+        return None
+    return json.loads(plan_path.read_text())
+
+
+def resume_settings(
+    plan: Dict[str, Any], target: Optional[str], column: Optional[str], model_version: Optional[str]
+) -> Tuple[str, Optional[str], str]:
+    """Return the (target, column, model version) a resumed job must keep, rejecting conflicting options."""
+    if "target" not in plan:
+        raise ValueError("Checkpoint plan does not record its target; start a new job without --resume")
+    for option, requested, planned in (
+        ("--target", target, plan["target"]),
+        ("--column", column, plan.get("column")),
+        ("--model-version", model_version, plan["modelVersion"]),
+    ):
+        if requested is not None and requested != planned:
+            raise ValueError(f"Checkpoint plan was started with {option} {planned}, not {requested}")
+    return plan["target"], plan.get("column"), plan["modelVersion"]
+
+
+def resolve_model_version(requested: Optional[str]) -> str:
+    """Pick the one concrete model version every shard scores with."""
+    return model_registry.resolve_version(requested)
+
+
+def plan_shards(
+    workers: int,
+    target: str,
+    column: Optional[str],
+    chunk_size: int,
+    model_version: str,
+    checkpoint_dir: Optional[str],
+    resume: bool,
+    start_id: Optional[int] = None,
+    end_id: Optional[int] = None,
+    plan: Optional[Dict[str, Any]] = None,
+) -> List[ShardTask]:
+    """Split the table into per-worker id ranges; when resuming `plan`, reuse its ranges instead.
+
+    `model_version` must already be resolved (see `resolve_model_version`). A new plan records it
+    together with the target and column, so a later --resume cannot write somewhere else.
+    """
+    plan_path = Path(checkpoint_dir) / PLAN_FILE if checkpoint_dir else None
+    if plan is not None:
+        ranges = [tuple(r) for r in plan["ranges"]]
+    else:
+        with SessionLocal() as db:
+            lo, hi = id_bounds(db)
+        if lo is None:
+            return []
+        lo = lo if start_id is None else max(lo, start_id)
+        hi = hi if end_id is None else min(hi, end_id)
+        if lo > hi:
+            return []
+        ranges = split_id_range(lo, hi, workers)
+        if plan_path is not None:
+            plan_path.parent.mkdir(parents=True, exist_ok=True)
+            _write_json(
+                plan_path,
+                {"ranges": ranges, "target": target, "column": column, "modelVersion": model_version},
+            )
+    return [
+        ShardTask(i, start, end, target, column, chunk_size, model_version, checkpoint_dir, resume)
+        for i, (start, end) in enumerate(ranges)
+    ]
@@ -2,13 +2,16 @@ from fastapi import FastAPI
 from contextlib import asynccontextmanager
 
 from app.db.session import create_all
+from app.services.model_registry import model_registry
 from app.controllers.auth_controller import router as auth_router
 from app.controllers.mental_controller import router as mental_router
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_all()
+    model_registry.start()
     yield
+    model_registry.stop()
 
 app = FastAPI(title="Psyche API", lifespan=lifespan)
 
@@ -0,0 +1,115 @@
+"""Recompute depressionState for every health_test row with the current (or a given) model version.
+
+Examples:
+    python rescore.py                                   # in place, one process
+    python rescore.py --workers 4 --checkpoint-dir .rescore
+    python rescore.py --checkpoint-dir .rescore --resume
+    python rescore.py --target table --model-version v3   # results go to health_test_rescore
+    python rescore.py --target column --column depressionStateV3
+"""
+import argparse
+import logging
+import multiprocessing
+import sys
+import time
+
+from app.db.session import create_all
+from app.services.rescore_service import (
+    TARGETS,
+    TARGET_INPLACE,
+    validate_target,
+    load_plan,
+    resume_settings,
+    resolve_model_version,
+    plan_shards,
+    rescore_shard,
+)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Bulk re-score historical health tests.")
+    parser.add_argument("--target", choices=TARGETS,
+                        help="inplace (default): overwrite depressionState/modelVersion; column: write into --column; "
+                             "table: write into health_test_rescore. A resumed job keeps its saved target")
+    parser.add_argument("--column", help="Existing health_test column to write into with --target column")
+    parser.add_argument("--model-version", help="Model version to score with (default: the one the API would serve)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Rows streamed, scored and updated per batch")
+    parser.add_argument("--workers", type=int, help="Processes, each scoring its own id range (default 1)")
+    parser.add_argument("--start-id", type=int, help="Only re-score ids >= this")
+    parser.add_argument("--end-id", type=int, help="Only re-score ids <= this")
+    parser.add_argument("--checkpoint-dir", help="Directory for per-shard progress; required for --resume")
+    parser.add_argument("--resume", action="store_true", help="Continue from the checkpoints in --checkpoint-dir")
+    args = parser.parse_args(argv)
+    if args.resume and not args.checkpoint_dir:
+        parser.error("--resume requires --checkpoint-dir")
+    if args.chunk_size < 1 or (args.workers is not None and args.workers < 1):
+        parser.error("--chunk-size and --workers must be at least 1")
+    return args
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(message)s")
+    args = parse_args(argv)
+
+    create_all()
+    plan = load_plan(args.checkpoint_dir) if args.resume else None
+    try:
+        if plan is not None:
+            # A resumed job keeps the target, column and model version it was started with
+            target, column, model_version = resume_settings(plan, args.target, args.column, args.model_version)
+            ignored = [
+                option for option, value in (
+                    ("--workers", args.workers), ("--start-id", args.start_id), ("--end-id", args.end_id),
+                ) if value is not None
+            ]
+            if ignored:
+                print(f"Resuming the saved plan in {args.checkpoint_dir}; ignoring {', '.join(ignored)}")
+        else:
+            target, column = args.target or TARGET_INPLACE, args.column
+            # Resolved once here so every shard, and a later --resume, scores with the same version
+            model_version = resolve_model_version(args.model_version)
+        validate_target(target, column)
+    except (ValueError, RuntimeError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    print(f"Re-scoring into {target}{f' ({column})' if column else ''} with model version {model_version}")
+
+    tasks = plan_shards(
+        workers=args.workers or 1,
+        target=target,
+        column=column,
+        chunk_size=args.chunk_size,
+        model_version=model_version,
+        checkpoint_dir=args.checkpoint_dir,
+        resume=args.resume,
+        start_id=args.start_id,
+        end_id=args.end_id,
+        plan=plan,
+    )
+    if not tasks:
+        print("No health_test rows to re-score.")
+        return 0
+
+    started = time.perf_counter()
+    if len(tasks) == 1:
+        results = [rescore_shard(tasks[0])]
+    else:
+        # spawn: TensorFlow and open DB connections do not survive fork
+        with multiprocessing.get_context("spawn").Pool(len(tasks)) as pool:
+            results = pool.map(rescore_shard, tasks)
+    wall = time.perf_counter() - started
+
+    print(f"{'shard':>5} {'id range':>23} {'rows':>10} {'changed':>10} {'seconds':>9} {'rows/s':>10}")
+    for r in results:
+        print(f"{r.shard:>5} {f'{r.startId}-{r.endId}':>23} {r.rows:>10} {r.changed:>10} {r.seconds:>9.1f} {r.rows_per_second:>10.0f}")
+    total = sum(r.rows for r in results)
+    changed = sum(r.changed for r in results)
+    # Shards run in parallel and their seconds include earlier resumed runs, so the slowest shard is the job time
+    busy = max(r.seconds for r in results)
+    print(f"total: {total} rows, {changed} changed, model {model_version}, "
+          f"{busy:.1f}s scoring ({wall:.1f}s this run), {total / busy if busy > 0 else 0:.0f} rows/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -55,7 +55,7 @@ with TestClient(app) as client:
     print("login-wrongpass status:", wp.status_code)
     print("login-wrongpass body:", wp.json())
 
-    p = client.post("/mental/predict", json={
+    predict_body = {
         "userId": 1,
         "language": "en",
         "appetite": 3,
@@ -70,6 +70,36 @@ with TestClient(app) as client:
         "panicAttacks": 5,
         "hopelessness": 3,
         "restlessness": 4
-    })
+    }
+    p = client.post("/mental/predict", json=predict_body)
     print("predict status:", p.status_code)
     print("predict body:", p.json())
+    model_version = p.json()["data"]["modelVersion"]
+    assert model_version, "predict did not record the serving model version"
+    print("predict modelVersion:", model_version)
+
+    headers = {"Idempotency-Key": "smoke-predict-1"}
+    i1 = client.post("/mental/predict", json=predict_body, headers=headers)
+    i2 = client.post("/mental/predict", json=predict_body, headers=headers)
+    print("idempotent predict statuses:", i1.status_code, i2.status_code)
+    print("idempotent replayed:", i2.headers.get("Idempotent-Replayed"), "same record:", i1.json().get("data", {}).get("id") == i2.json().get("data", {}).get("id"))
+
+    h1 = client.get("/mental/history/1")
+    etag = h1.headers.get("ETag")
+    h2 = client.get("/mental/history/1", headers={"If-None-Match": etag})
+    print("history etag:", etag, "revalidate status:", h2.status_code)
+    assert all(row["modelVersion"] == model_version for row in h1.json()["data"]), "history lost modelVersion"
+
+# Offline re-scoring into a hand-added column (the ORM model does not declare it)
+from sqlalchemy import text
+from app.db.session import engine
+import rescore
+
+with engine.begin() as conn:
+    conn.execute(text('ALTER TABLE health_test ADD COLUMN "depressionStateV3" INTEGER'))
+rc = rescore.main(["--target", "column", "--column", "depressionStateV3", "--chunk-size", "2"])
+with engine.connect() as conn:
+    rescored = conn.execute(text('SELECT COUNT(*) FROM health_test WHERE "depressionStateV3" IS NOT NULL')).scalar()
+    total = conn.execute(text("SELECT COUNT(*) FROM health_test")).scalar()
+print("rescore column status:", rc, "rows:", rescored, "/", total)
+assert rc == 0 and rescored == total, "rescore --target column did not fill every row"